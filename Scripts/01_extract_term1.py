@@ -1,12 +1,12 @@
- """Build per-year skill co-occurrence counts from Parquet files using DuckDB
+"""Build per-year skill co-occurrence counts from Parquet files using DuckDB
   
-Reads all Parquet files for a given YEAR under ROOT_DIR/YEAR/SUBDIR,
+For every year in YEARS, reads all Parquet files under ROOT_DIR/YEAR/SUBDIR,
 explodes the pipe-separated skill list, computes per-skill counts and the
-co-occurrence with predefined AI terms, and writes a single output file
-(CSV or Parquet) to OUT_DIR. 
+co-occurrence with predefined AI terms, and writes one output file per year
+(CSV or Parquet) to OUT_DIR. All years share a single DuckDB connection.
 
 Inputs: 
-(1) YEAR: Users are required to run through 2010-2024, one year at a time
+(1) YEARS: The years to process in this run, e.g. [2010] or list(range(2010, 2025))
 (2) ROOT_DIR: The path of the folder `jobs_by_year' in the USB
 (3) OUT_DIR: The path of the folder `out' in the USB
 (4) TMP_DIR: The path of the folder `duckdb_tmp' in the USB 
@@ -16,17 +16,34 @@ import glob
 import os 
 import duckdb
 
-YEAR = 2024
+try:
+    import psutil  # optional: used to count physical cores
+except ImportError:
+    psutil = None
+
+YEARS = [2024]        # years to process; e.g. list(range(2010, 2025)) runs 2010-2024 in one go
 SAVE_AS = "parquet"   # choose to save the file as 'csv' or 'parquet' 
 
 ROOT_DIR = r"E:\\jobs_by_year"         # root folder containing year-level data 
 SUBDIR   = "parquet"                   # subfolder under yearly data folder 
 COL_NAME = r"skills_name"              # columns that contains the skills list 
-JOB_ID   = "id"                        # unique identifier for a job   
+
+# AI core words we define; inlined into the SQL below as a constant IN-list
+AI_TERMS = (
+    "ai",
+    "artificial intelligence",
+    "ml",
+    "machine learning",
+    "nlp",
+    "natural language processing",
+    "cv",
+    "computer vision",
+)
 
 OUT_DIR  = r"E:\\out"                  # output folder
 TMP_DIR  = r"E:\\duckdb_tmp"           # DuckDB spill/temp directory (fast disk)
 MEM_LIMIT = "24GB"                     # memory cap; spills beyond this limit  
+N_THREADS = (psutil and psutil.cpu_count(logical=False)) or os.cpu_count()  # one thread per physical core
 
 # Ensure output/temp folders exist  
 os.makedirs(OUT_DIR, exist_ok=True)
@@ -34,84 +51,99 @@ os.makedirs(TMP_DIR,  exist_ok=True)
 
 
 def norm(p: str) -> str:
-  """Normalize a Windows path to forward slashes for DuckDB stability"""
+    """Normalize a Windows path to forward slashes for DuckDB stability"""
     return os.path.abspath(p).replace("\\", "/")
 
-pattern = f"{norm(ROOT_DIR)}/{YEAR}/{SUBDIR}/*.parquet"  # Ex: D:/jobs_by_year/2010/parquet/*.parquet
-# Make sure there are files for the given year 
-if not glob.glob(pattern):
-    raise FileNotFoundError(f"Cannot find any files : {pattern}")
+ai_terms_sql = ", ".join(f"'{t}'" for t in AI_TERMS)  # -> 'ai', 'artificial intelligence', ...
 
-# Decide output filename and DuckDB COPY options based on SAVE_AS  
-out_all = (
-    f"{norm(OUT_DIR)}/{YEAR}_skills_counts_co."
-    f"{'parquet' if SAVE_AS == 'parquet' else 'csv'}"
-)
+# Decide DuckDB COPY options based on SAVE_AS  
 copy_opts = (
-    "(FORMAT 'parquet', COMPRESSION 'ZSTD')"
+    "(FORMAT 'parquet', COMPRESSION 'ZSTD', COMPRESSION_LEVEL 3, ROW_GROUP_SIZE 1048576, PARQUET_VERSION 'V2')"
     if SAVE_AS == "parquet"
     else "(HEADER, DELIMITER ',')"
 )
 
 # Establish DuckDB connection and resource settings 
 con = duckdb.connect() 
-con.execute(f"PRAGMA threads={os.cpu_count()};")          # use all CPU cores 
+con.execute(f"PRAGMA threads={N_THREADS};")               # one thread per physical core 
 con.execute(f"PRAGMA memory_limit='{MEM_LIMIT}';")        # memory cap 
-con.execute(f"PRAGMA temp_directory='{norm(TMP_DIR)}';")  # spill directory 
+con.execute("SET temp_directory = ?;", [norm(TMP_DIR)])     # spill directory 
+con.execute("PRAGMA preserve_insertion_order=false;")      # stream COPY output; ORDER BY is still honored 
 con.execute("PRAGMA enable_progress_bar;")                # show progress bar  
 
-# Combined Parquet and compute:
-# - cnt: number of jobs containing the skills (per year) 
-# - co_jobs_with_ai: among those, number of jobs that include any AI core term   
-con.execute(f"""
-COPY (
-  WITH
-  base AS (
-    SELECT CAST({JOB_ID} AS VARCHAR) AS job_id,           
-           CAST({COL_NAME} AS VARCHAR) AS skills
-    FROM read_parquet('{pattern}', union_by_name=true, hive_partitioning=0) -- Read all parquet files in the folder for the specified year 
-    WHERE {COL_NAME} IS NOT NULL AND {COL_NAME} <> ''                       --Filter out columns with all cells empty 
-  ),
-  exploded AS (                                                             -- job1 : 'A|B|C' => job1:'a', job1:'b', job1:'c' 
-    SELECT job_id, lower(trim(x)) AS skill                                  -- Standardize to prevent 'Python' and 'python' being split into two separate entries 
-    FROM base, UNNEST(str_split(skills, '|')) AS t(x)                       -- Expand the array into multiple rows
-    WHERE x IS NOT NULL AND x <> ''
-  ),
-  ai_terms(term) AS (  -- Create a constant table with only one column named 'term', listing AI core words we define
-    VALUES
-      ('ai'),
-      ('artificial intelligence'),
-      ('ml'),
-      ('machine learning'),
-      ('nlp'),
-      ('natural language processing'),
-      ('cv'),
-      ('computer vision')
-  ),
-  ai_jobs AS (                                      -- Extract the columns containing skills belonging to the AI vocabulary list from the exploded data, retaining their job_id
-    SELECT DISTINCT job_id                          -- For the same job, even if there are multiple AI terms, only keep one entry to avoid duplicate counting later 
-    FROM exploded
-    WHERE skill IN (SELECT term FROM ai_terms)
-  )
+
+def run_year(con, year: int) -> None:
+    """Write the skill counts and AI co-occurrences of one year to OUT_DIR."""
+    pattern = f"{norm(ROOT_DIR)}/{year}/{SUBDIR}/*.parquet"  # Ex: D:/jobs_by_year/2010/parquet/*.parquet
+    # Make sure there are files for the given year 
+    if not glob.glob(pattern):
+        raise FileNotFoundError(f"Cannot find any files : {pattern}")
+
+    # Output file for this year
+    out_all = (
+        f"{norm(OUT_DIR)}/{year}_skills_counts_co."
+        f"{'parquet' if SAVE_AS == 'parquet' else 'csv'}"
+    )
+
+    # Schema check (once per year): the year's Parquet shards come from the same pull, so
+    # their schemas normally match and can be read positionally (union_by_name=false)
+    # without per-file name reconciliation. If any file differs, align by name.
+    schemas = {
+        tuple(con.execute("DESCRIBE SELECT * FROM read_parquet(?)", [norm(p)]).fetchall())
+        for p in glob.glob(pattern)
+    }
+    union_by_name = len(schemas) > 1
+
+    # Combined Parquet and compute:
+    # - cnt: number of jobs containing the skills (per year) 
+    # - co_jobs_with_ai: among those, number of jobs that include any AI core term   
+    con.execute(f"""
+    COPY (
+      WITH
+      base AS (                                                                 -- The scan reads only the projected columns; CAST to VARCHAR is a no-op on string columns 
+        SELECT lower(CAST({COL_NAME} AS VARCHAR)) AS skills_lc      -- Lowercase once per job to prevent 'Python' and 'python' being split into two separate entries 
+        FROM read_parquet($pattern, union_by_name=$union_by_name, hive_partitioning=0, -- Read all parquet files in the folder for the specified year 
+                          filename=false)                                       -- Only the skills column is decoded 
+        WHERE {COL_NAME} IS NOT NULL AND {COL_NAME} <> ''                       --Filter on the raw column so it is pushed into the scan 
+      ),
+      skill_lists AS (                                                          -- job1 : 'A|B|C' => job1:['a','b','c'] 
+        SELECT
+          list_filter(                                                          -- Drop empty tokens
+            list_distinct(                                                      -- Each skill counted once per job, even if listed twice
+              list_transform(str_split(skills_lc, '|'), x -> trim(x))          -- Only trim per token; the string is already lowercased in base 
+            ),
+            y -> y <> '') AS skills
+        FROM base
+      ),
+      exploded AS (                                                             -- job1:['a','b','c'] => job1:'a', job1:'b', job1:'c' 
+        SELECT
+          list_has_any(skills, [{ai_terms_sql}]) AS job_is_ai,                -- Whether the job contains any AI core word, decided on the list before the fan-out
+          UNNEST(skills) AS skill                                               -- Expand the array into multiple rows
+        FROM skill_lists
+      )
   
-  -- Final aggregation: for each normalized skill, output 
-  --    -cnt: total number of job rows that contain this skill in the year 
-  --    -co_jobs_with_ai: number of those rows whose job_id is an AI job (co-occurrence with any AI core word)
-  -- Assumptions:
-  --    * Each (job_id, skill) pair appears at most once (no duplicate same-skill tokens per job)
-  --    * ai_jobs contains DISTINCT job_ids that have at least one AI core word 
+      -- Final aggregation: for each normalized skill, output 
+      --    -cnt: total number of job rows that contain this skill in the year 
+      --    -co_jobs_with_ai: number of those rows whose job is an AI job (co-occurrence with any AI core word)
+      -- Assumptions:
+      --    * Each posting row counts as one job, and a skill appears at most once per row (enforced by list_distinct in skill_lists)
+      --    * job_is_ai is computed once per posting row and copied to each of its skill rows, so no join or window is needed;
+      --      rows that share an id are not pooled, and rows with a NULL id are counted like any other row
   
-  SELECT
-    e.skill,
-    COUNT(*)::BIGINT AS cnt,                                -- jobs containing this skill (since job_id+skill is unique)
-    SUM(CASE WHEN aj.job_id IS NOT NULL
-             THEN 1 ELSE 0 END)::BIGINT AS co_jobs_with_ai  -- among those, jobs that are AI jobs (co-occurrence count)
-  FROM exploded e
-  LEFT JOIN ai_jobs aj USING (job_id)                       -- keep non-AI jobs too; ai.job_id is NULL for them => adds 0 
-  -- WHERE e.skill NOT IN (SELECT term FROM ai_terms)       -- (optional) exclude AI terms themselves from the output
-  GROUP BY e.skill                                          -- aggregate per skill 
-  ORDER BY co_jobs_with_ai DESC, cnt DESC, e.skill          -- sort by co-occurrence, then total count, then skill name 
-) TO '{out_all}' {copy_opts};
-""")
-
-print("DONE. single file output：", out_all)
\ No newline at end of file
+      SELECT
+        skill,
+        COUNT(*)::BIGINT AS cnt,                                -- posting rows containing this skill (since row+skill is unique)  
+        COUNT_IF(job_is_ai)::BIGINT AS co_jobs_with_ai          -- among those, jobs that are AI jobs (co-occurrence count)
+      FROM exploded
+      -- WHERE skill NOT IN ({ai_terms_sql})                   -- (optional) exclude AI terms themselves from the output
+      GROUP BY skill                                            -- aggregate per skill 
+      -- No ORDER BY: 02 re-aggregates these rows anyway; to browse, sort when reading with
+      -- ORDER BY co_jobs_with_ai DESC, cnt DESC, skill
+    ) TO $out_all {copy_opts};
+    """, {"pattern": pattern, "union_by_name": union_by_name, "out_all": out_all})
+
+    print(f"DONE {year}. single file output：", out_all)
+
+
+for year in YEARS:
+    run_year(con, year)
\ No newline at end of file
@@ -15,9 +15,15 @@ import os
 import glob 
 import duckdb 
 
+try:
+    import psutil  # optional: used to count physical cores
+except ImportError:
+    psutil = None
+
 OUT_DIR = r"E:\\out"          # Folder with per-year outputs (e.g., 2010_skills_counts_co.parquet)
 TMP_DIR = r"E:\\duckdb_tmp"   # DuckDB spill/temp directory (ensure plenty of space; put on SSD/NvMe) 
 MEM_LIMIT = "24GB"            # Memory cap for DuckDB
+N_THREADS = (psutil and psutil.cpu_count(logical=False)) or os.cpu_count()  # One thread per physical core
 SAVE_AS = "parquet"           # Final output format: "parquet" or "csv" 
 MIN_JOBS = 50                 # optional: filter out very rare skills in the global table 
 
@@ -31,38 +37,34 @@ def norm(p: str) -> str:
 
 out_dir = norm(OUT_DIR) 
 
-parquet_files = sorted(
-    glob.glob(f"{out_dir}/[0-9][0-9][0-9][0-9]_skills_counts_co.parquet")
-)
-csv_files = sorted(
-    glob.glob(f"{out_dir}/[0-9][0-9][0-9][0-9]_skills_counts_co.csv")
-)
+parquet_glob = f"{out_dir}/[0-9][0-9][0-9][0-9]_skills_counts_co.parquet"
+csv_glob     = f"{out_dir}/[0-9][0-9][0-9][0-9]_skills_counts_co.csv"
 
-# parquet_files = sorted(glob.glob(f"{out_dir}/201[0-8]_skills_counts_co.parquet"))
-# csv_files     = sorted(glob.glob(f"{out_dir}/201[0-8]_skills_counts_co.csv"))
+# parquet_glob = f"{out_dir}/201[0-8]_skills_counts_co.parquet"
+# csv_glob     = f"{out_dir}/201[0-8]_skills_counts_co.csv"
+
+parquet_files = sorted(glob.glob(parquet_glob))
+csv_files = sorted(glob.glob(csv_glob))
 
 if parquet_files:
-    # build a DuckDB list literal of file paths: ['path1', 'path2',...]
-    # read_parquet([...], union_by_name=true) loads many files as one table 
-    # (column-aligned by name)
-    src_list  = "[" + ",".join(f"'{norm(p)}'" for p in parquet_files) + "]"
-    read_src  = f"read_parquet({src_list}, union_by_name=true)"
+    # The glob itself is handed to read_parquet (see below), so DuckDB
+    # expands the file list and prunes each file independently
+    src_glob  = parquet_glob
     src_kind  = "parquet"
 elif csv_files:
-    # read_csv_auto([...], union_by_name=true) similarly unions many CSVs
+    # read_csv_auto(glob, union_by_name=true) unions many CSVs and
     # auto-infers column types 
-    src_list  = "[" + ",".join(f"'{norm(p)}'" for p in csv_files) + "]"
-    read_src  = f"read_csv_auto({src_list}, union_by_name=true)"
+    src_glob  = csv_glob
     src_kind  = "csv"
 else:
     raise FileNotFoundError(
         "No yearly files like YYYY_skills_counts_co.(parquet|csv) found in OUT_DIR."
     )
 
-print(src_list)
+print(f"{len(parquet_files or csv_files)} files: {src_glob}")
   
 copy_opts = (
-    "(FORMAT 'parquet', COMPRESSION 'ZSTD')"
+    "(FORMAT 'parquet', COMPRESSION 'ZSTD', ROW_GROUP_SIZE 1048576, PARQUET_VERSION 'V2')"
     if SAVE_AS == "parquet"
     else "(HEADER, DELIMITER ',')"
 )
@@ -80,19 +82,36 @@ out_top = (
 filter_clause = f"WHERE total_cnt >= {MIN_JOBS}" if MIN_JOBS > 0 else ""
 
 con = duckdb.connect()
-con.execute(f"PRAGMA threads={os.cpu_count()};")          # use all available CPU cores 
+con.execute(f"PRAGMA threads={N_THREADS};")               # one thread per physical core 
 con.execute(f"PRAGMA memory_limit='{MEM_LIMIT}';")        # harp cap on memory usage
-con.execute(f"PRAGMA temp_directory='{norm(TMP_DIR)}';")  # spill directory for large sorts/aggregations
+con.execute("SET temp_directory = ?;", [norm(TMP_DIR)])     # spill directory for large sorts/aggregations
+con.execute("PRAGMA preserve_insertion_order=false;")      # stream COPY output; ORDER BY is still honored
 con.execute("PRAGMA enable_progress_bar;")                # show progress bar during heavy queries 
 
+# One-time schema check: yearly Parquet files are written by the same script,
+# so their schemas normally match and can be read positionally
+# (union_by_name=false) without per-file name reconciliation. If any file
+# differs, fall back to aligning columns by name.
+if src_kind == "parquet":
+    schemas = {
+        tuple(con.execute("DESCRIBE SELECT * FROM read_parquet(?)", [norm(p)]).fetchall())
+        for p in parquet_files
+    }
+    union_by_name = len(schemas) > 1
+    read_src = "read_parquet($src_glob, union_by_name=$union_by_name)"
+else:
+    union_by_name = True
+    read_src = "read_csv_auto($src_glob, union_by_name=$union_by_name)"
+
 # ----① Build the all-years table: skill, total_cnt, total_co, ai_score ----
 # Pipeline:
 #   all_years: read all yearly files as one table; normalize text and cast numeric columns
 #   agg:       group by skill and sum counts across all years
 #   filtered:  apply MIN_JOBS threshold (if any)
-#   final:     compute ai_score = total_co / total_cnt; sort for convenience 
+#   final:     compute ai_score = total_co / total_cnt, kept as a temp table so
+#              both exports below read it in memory
 con.execute(f"""
-COPY (
+CREATE TEMP TABLE final AS
   WITH
   all_years AS (  
     SELECT
@@ -119,20 +138,25 @@ COPY (
     total_co,
     CASE WHEN total_cnt > 0 THEN total_co * 1.0 / total_cnt ELSE 0 END AS ai_score
   FROM filtered
+""", {"src_glob": src_glob, "union_by_name": union_by_name})
+
+# Export the global table, sorted for convenience
+con.execute(f"""
+COPY (
+  SELECT * FROM final
   ORDER BY ai_score DESC, total_cnt DESC, skill
-) TO '{out_all}' {copy_opts};
-""")
+) TO ? {copy_opts};
+""", [out_all])
 
 # ---- ② Produce a Top-100 file by ai_score (ties broken by total_cnt, then skill) ----
-# We re-read the just written global table and slice the top 100 rows 
+# Slice the top 100 rows from the in-memory table instead of re-reading out_all
 con.execute(f"""
 COPY (
-  SELECT *
-  FROM read_{'parquet' if SAVE_AS=='parquet' else 'csv_auto'}('{out_all}')
+  SELECT * FROM final
   ORDER BY ai_score DESC, total_cnt DESC, skill
   LIMIT 100
-) TO '{out_top}' {copy_opts};
-""")
+) TO ? {copy_opts};
+""", [out_top])
 
 print(f"Done. Source kind: {src_kind}")
 print(" - All years merged:", out_all)
@@ -17,6 +17,11 @@ import os
 import glob 
 import duckdb 
 
+try:
+    import psutil  # optional: used to count physical cores
+except ImportError:
+    psutil = None
+
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
@@ -33,6 +38,7 @@ COMPANY_NAME = "company_name"
 OUT_DIR   = r"E:\\out"        
 TMP_DIR   = r"E:\\duckdb_tmp" 
 MEM_LIMIT = "24GB"
+N_THREADS = (psutil and psutil.cpu_count(logical=False)) or os.cpu_count()  # one thread per physical core
 
 os.makedirs(OUT_DIR, exist_ok=True)
 os.makedirs(TMP_DIR, exist_ok=True) 
@@ -50,9 +56,9 @@ all_parquet = f"{norm(OUT_DIR)}/all_years_skills_counts_co.parquet"
 all_csv     = f"{norm(OUT_DIR)}/all_years_skills_counts_co.csv"
 
 if os.path.exists(all_parquet):
-    skill_src_fn = f"read_parquet('{all_parquet}')"
+    skill_src, skill_src_fn = all_parquet, "read_parquet(?)"
 elif os.path.exists(all_csv):
-    skill_src_fn = f"read_csv_auto('{all_csv}')"
+    skill_src, skill_src_fn = all_csv, "read_csv_auto(?)"
 else:
     raise FileNotFoundError("cannot find all_years_skills_counts_co.(parquet|csv), please generate the file first")
 
@@ -61,7 +67,7 @@ out_jobs = (
     f"{'parquet' if SAVE_AS=='parquet' else 'csv'}"
 )
 copy_opts = (
-    "(FORMAT 'parquet', COMPRESSION 'ZSTD')"
+    "(FORMAT 'parquet', COMPRESSION 'ZSTD', ROW_GROUP_SIZE 1048576, PARQUET_VERSION 'V2', FIELD_IDS 'auto')"
     if SAVE_AS == "parquet"
     else "(HEADER, DELIMITER ',')"
 )
@@ -71,42 +77,66 @@ copy_opts = (
 # ---------------------------------------------------------------------------
 
 con = duckdb.connect()
-con.execute(f"PRAGMA threads={os.cpu_count()};")
+con.execute(f"PRAGMA threads={N_THREADS};")
 con.execute(f"PRAGMA memory_limit='{MEM_LIMIT}';")
-con.execute(f"PRAGMA temp_directory='{norm(TMP_DIR)}';")
+con.execute("SET temp_directory = ?;", [norm(TMP_DIR)])
+con.execute("PRAGMA preserve_insertion_order=false;")
 con.execute("PRAGMA enable_progress_bar;")
 
+# One-time schema check: the year's Parquet shards come from the same pull, so
+# their schemas normally match and can be read positionally (union_by_name=false)
+# without per-file name reconciliation. If any file differs, align by name.
+schemas = {
+    tuple(con.execute("DESCRIBE SELECT * FROM read_parquet(?)", [norm(p)]).fetchall())
+    for p in glob.glob(year_pattern)
+}
+union_by_name = len(schemas) > 1
+
+# ------------------------------------------------------------------------------------------
+# 0) Load the skill -> ai_score dictionary once into memory
+#    The dictionary is small (a few thousand skills), so the join below probes a
+#    resident table instead of re-scanning the file
+# ------------------------------------------------------------------------------------------
+
+con.execute(f"""
+CREATE TEMP TABLE skill_ai AS
+SELECT lower(trim(skill)) AS skill, ai_score
+FROM {skill_src_fn}
+""", [skill_src])
+
 # ------------------------------------------------------------------------------------------
 # 1) Compute per-job AI score 
+#    Kept as a temp table so the company aggregation in step 2 reads it in-process
+#    instead of re-reading the Parquet output just written
 # ------------------------------------------------------------------------------------------
 
 sql = f"""
-COPY (
+CREATE TEMP TABLE per_job_ai AS
   WITH
+  -- Only the four projected columns are read from the files (the CASTs sit
+  -- above the scan, and a CAST to VARCHAR on a string column is dropped)
   base AS (
     SELECT
-      CAST({JOB_ID} AS VARCHAR) AS job_id,
+      {JOB_ID} AS job_id,                    -- Native id type (e.g. BIGINT): smaller hash keys for GROUP BY job_id
       CAST({COMPANY} AS VARCHAR) AS company,
       CAST({COMPANY_NAME} AS VARCHAR)  AS company_name,
-      CAST({COL_NAME} AS VARCHAR) AS skills
-    FROM read_parquet('{year_pattern}', union_by_name=true, hive_partitioning=0)
-    WHERE {COL_NAME} IS NOT NULL AND {COL_NAME} <> ''
+      lower(CAST({COL_NAME} AS VARCHAR)) AS skills_lc  -- Lowercase once per job, so tokens only need trim()
+    FROM read_parquet($year_pattern, union_by_name=$union_by_name, hive_partitioning=0, filename=false)
+    WHERE {COL_NAME} IS NOT NULL AND {COL_NAME} <> ''  -- Filter on the raw column so it is pushed into the scan
   ),
+  -- Normalize, drop empty tokens and de-duplicate within each job's skill list
+  -- before unnesting, so the same (job_id, skill) is not counted more than once.
+  -- If you want repeated occurrences of the same skill within a job to count,
+  -- remove the list_distinct() call.
   exploded AS (
     SELECT
       job_id,
       company,
       company_name,
-      lower(trim(x)) AS skill
-    FROM base, UNNEST(str_split(skills, '|')) AS t(x)
-    WHERE x IS NOT NULL AND x <> ''
-  ),
-  -- De-duplicate to avoid counting the same (job_id, skill) more than once
-  -- If you want repeated occurrences of the same skill within a job to count,
-  -- remove this CTE and join from `exploded` directly in the next step. 
-  dedup AS (
-    SELECT DISTINCT job_id, company, company_name, skill
-    FROM exploded
+      unnest(list_filter(
+        list_distinct(list_transform(str_split(skills_lc, '|'), x -> trim(x))),
+        y -> y <> '')) AS skill
+    FROM base
   ),
   joined AS (
     SELECT
@@ -114,8 +144,8 @@ COPY (
       d.company,
       d.company_name, 
       s.ai_score
-    FROM dedup d
-    LEFT JOIN {skill_src_fn} s
+    FROM exploded d
+    LEFT JOIN skill_ai s
       ON d.skill = s.skill
   ),
   per_job AS (
@@ -136,17 +166,17 @@ COPY (
     job_ai_score,
     n_skills,
     n_matched_skills,
-    CASE WHEN job_ai_score > 0.1 THEN 1 ELSE 0 END AS ai_job
+    COALESCE(job_ai_score > 0.1, false)::UTINYINT AS ai_job  -- NULL score (no matched skills) counts as 0
   FROM per_job
   -- Keep only jobs with at least one matched skill by uncommenting the line below 
   -- WHERE n_matched_skills > 0
-  ORDER BY job_ai_score DESC NULLS LAST, n_matched_skills DESC, job_id
-) TO '{out_jobs}' {copy_opts};
 """
-con.execute(sql)
+con.execute(sql, {"year_pattern": year_pattern, "union_by_name": union_by_name})
+
+# No global ORDER BY: sort when reading the output if needed
+con.execute(f"COPY per_job_ai TO ? {copy_opts};", [out_jobs])
 
-read_fn = f"read_{'parquet' if SAVE_AS=='parquet' else 'csv_auto'}"
-n = con.execute(f"SELECT COUNT(*) FROM {read_fn}('{out_jobs}')").fetchone()[0]
+n = con.execute("SELECT COUNT(*) FROM per_job_ai").fetchone()[0]
 print("DONE.")
 print(f" - Per-job AI scores saved to: {out_jobs}")
 print(f" - Rows: {n}")
@@ -155,19 +185,19 @@ print(f" - Rows: {n}")
 # 2) Aggregate to company-year level  
 # ------------------------------------------------------------------------------------------
 
-per_job_rel = f"{read_fn}('{out_jobs}')"
-sql_company_share = f"""
+out_share = f"{norm(OUT_DIR)}/{YEAR}_company_ai_share.parquet"
+sql_company_share = """
 COPY (
   SELECT
     company,
     company_name,
     COUNT(*)                       AS n_postings,
-    SUM(ai_job)                    AS n_ai_jobs,
+    SUM(ai_job)::BIGINT            AS n_ai_jobs,
     AVG(CAST(ai_job AS DOUBLE))    AS ai_job_share  
-  FROM {per_job_rel}
+  FROM per_job_ai
   GROUP BY company, company_name
   ORDER BY ai_job_share DESC NULLS LAST, n_postings DESC, company_name
-) TO '{norm(OUT_DIR)}/{YEAR}_company_ai_share.parquet' (FORMAT 'parquet', COMPRESSION 'ZSTD');
+) TO ? (FORMAT 'parquet', COMPRESSION 'ZSTD', ROW_GROUP_SIZE 1048576, PARQUET_VERSION 'V2');
 """
-con.execute(sql_company_share)
+con.execute(sql_company_share, [out_share])
 print("Successfully saved the calculated measures in the given year!")
\ No newline at end of file
@@ -16,6 +16,12 @@ Inputs:
 
 import duckdb 
 import os 
+import re 
+
+try:
+    import psutil  # optional: used to count physical cores
+except ImportError:
+    psutil = None
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -26,6 +32,11 @@ KEYWORDS_PARQUET = r"E:\\top100_ai_skills_all_years.parquet"
 OUT_PARQUET = r"E:\\temp.parquet"
 OUT_PARQUET_FLAG = r"E:\\temp1.parquet"
 OUT_PARQUET_COMP = r"E:\\temp2.parquet"
+TMP_DIR = r"C:\\duckdb_temp"  # DuckDB spill/temp directory
+MEM_LIMIT = "20GB"
+N_THREADS = (psutil and psutil.cpu_count(logical=False)) or os.cpu_count()  # one thread per physical core
+
+os.makedirs(TMP_DIR, exist_ok=True)  # spill directory must exist before large joins/aggregations
 
 TABLE_NAME = "resume" 
 DEST_TABLE = "resume_years"
@@ -42,12 +53,14 @@ COL_DESC = "description_raw"
 # ---------------------------------------------------------------------------
 
 con = duckdb.connect() 
-con.execute("PRAGMA temp_directory='C:\\\\duckdb_temp';")           
-con.execute("PRAGMA memory_limit='20GB';")    
+con.execute(f"PRAGMA threads={N_THREADS};")
+con.execute("SET temp_directory = ?;", [TMP_DIR])           
+con.execute(f"PRAGMA memory_limit='{MEM_LIMIT}';")    
 con.execute("PRAGMA enable_progress_bar=true;")
+con.execute("PRAGMA preserve_insertion_order=false;")  # Let COPY stream rows in any order; outputs that need order sort explicitly
 
 # ---------------------------------------------------------------------------
-# 1) Load raw CSV into a normalized table with parsed dates and flags
+# 1) Load raw CSV into a normalized table with parsed start/end years
 # ---------------------------------------------------------------------------
 
 print("Break point 0")
@@ -61,14 +74,17 @@ con.execute(f"""
             {COL_DESC}    AS description_raw,
             NULLIF(TRIM({COL_START}), '') AS start_txt,
             NULLIF(TRIM({COL_END}),   '') AS end_txt
-        FROM read_parquet('{INPUT_PATH}')
+        FROM read_parquet(?)
+        -- Spells without a start month are dropped in step 2 anyway; filtering
+        -- in the scan skips reading their description_raw
+        WHERE {COL_START} IS NOT NULL
     )
     SELECT
         id, title_name, company_name_raw, description_raw,
-        CAST(try_strptime(start_txt || '-01', '%Y-%m-%d') AS DATE) AS job_start_ym,
-        CAST(try_strptime(end_txt   || '-01', '%Y-%m-%d') AS DATE) AS job_end_ym
+        TRY_CAST(substr(start_txt, 1, 4) AS SMALLINT) AS job_start_year,  -- 'YYYY-MM': only the year is used
+        TRY_CAST(substr(end_txt,   1, 4) AS SMALLINT) AS job_end_year
     FROM raw
-""")
+""", [INPUT_PATH])
 
 print("Break point 1")
 
@@ -76,157 +92,173 @@ print("Break point 1")
 # 2) Expand each employment spell into one row per year (inclusive)
 #    - Drop rows with missing end AND is_current = 0
 #    - Guard against end < start using GREATEST
+#    - Text columns stay on the spell table (one row per spell); the yearly
+#      table only carries (row_id, id, year) and joins back on row_id
 # ---------------------------------------------------------------------------
 
 con.execute(f"""
-    CREATE OR REPLACE TABLE {DEST_TABLE} AS
+    CREATE OR REPLACE TABLE resume_spells AS
     WITH base AS (
         SELECT
-            id, title_name, company_name_raw, description_raw, job_start_ym, job_end_ym,
-            year(job_start_ym) AS sy,
+            id, title_name, company_name_raw, description_raw,
+            job_start_year AS sy,
             CASE
-              WHEN job_end_ym IS NOT NULL THEN year(job_end_ym)
+              WHEN job_end_year IS NOT NULL THEN job_end_year
               ELSE year(current_date()) 
             END AS ey_pre
         FROM {TABLE_NAME}
-        WHERE job_start_ym IS NOT NULL
+        WHERE job_start_year IS NOT NULL
     ),
     filtered AS (
         -- Keep only rows with a resolvable end year (incl. current jobs).
-        SELECT
+        -- DISTINCT drops exact duplicate spells before they are expanded to years
+        SELECT DISTINCT
             id, title_name, company_name_raw, description_raw, sy,
             GREATEST(ey_pre, sy) AS ey 
         FROM base
         WHERE ey_pre IS NOT NULL
     )
     SELECT
+        row_number() OVER () AS row_id,  -- Spell key used to join yearly rows back
         id,
         title_name,
         company_name_raw,
         description_raw,
-        y AS year
+        sy,
+        ey
     FROM filtered
-    CROSS JOIN range(sy, ey + 1) AS t(y)   -- Inclusive of end year 
-    ORDER BY id, year
 """)
 
 con.execute(f"""
-  COPY (SELECT * FROM resume_years ORDER BY id, title_name, year)
-  TO '{OUT_PARQUET}'
-  (FORMAT PARQUET);
+    CREATE OR REPLACE TABLE {DEST_TABLE} AS
+    SELECT
+        row_id,
+        id,
+        unnest(generate_series(sy, ey)) AS year  -- Inclusive of end year 
+    FROM resume_spells
 """)
 
+con.execute(f"""
+  COPY (
+    SELECT y.id, s.title_name, s.company_name_raw, y.year
+    FROM {DEST_TABLE} y
+    JOIN resume_spells s USING (row_id)
+  )
+  TO ?
+  (FORMAT PARQUET, COMPRESSION ZSTD, COMPRESSION_LEVEL 3, ROW_GROUP_SIZE 1048576, PARQUET_VERSION V2);
+""", [OUT_PARQUET])
+
 print("Break point 2")
 
 # ---------------------------------------------------------------------------
 # 3) Load AI keyword list from parquet and normalize
 # ---------------------------------------------------------------------------
 
-con.execute(f"""
-    CREATE TABLE ai_keywords AS
+con.execute("""
+    CREATE TEMP TABLE ai_keywords AS
     SELECT DISTINCT LOWER(TRIM(skill)) AS skill
-    FROM read_parquet('{KEYWORDS_PARQUET}')
+    FROM read_parquet(?)
     WHERE skill IS NOT NULL AND TRIM(skill) <> '';
-""")
+""", [KEYWORDS_PARQUET])
 
 # ---------------------------------------------------------------------------
 # 4) Build a lowercase concatenated text field for simple substring matching
 #    - text_all = lower(title_name) + ' ' + lower(description_raw or '')
+#    - Built once per spell, so lower()/concat do not repeat for every year
 # ---------------------------------------------------------------------------
 
 con.execute("""
-    CREATE VIEW resume_years_text AS
+    CREATE OR REPLACE TABLE resume_spells_text AS
     SELECT
-        id,
-        title_name,
-        company_name_raw,
-        description_raw,
-        "year",
+        row_id,
         LOWER(COALESCE(title_name, '')) || ' ' || LOWER(COALESCE(description_raw, '')) AS text_all
-    FROM resume_years
+    FROM resume_spells
 """)
 
 # ---------------------------------------------------------------------------
-# 5) For each row, select the first matching keyword by earliest position
+# 5) For each spell, select the first matching keyword by earliest position
+#    and flag AI-related spells using the presence of first_hit_skill, then
+#    attach the flag to every year of the spell
+#    - All keywords are compiled into one regex alternation, so each text_all
+#      is scanned once instead of once per keyword
+#    - Longer keywords come first, so the longest keyword wins on ties
 #    - first_hit_skill is NULL when no keyword matches
+#    - Hit and flag are computed in the same pass over resume_spells_text
+#    - The regex probe replaces a per-row scan of ai_keywords, so no
+#      correlated/LATERAL keyword lookup is needed
+#    - The match stays inside DuckDB (RE2, all threads); an external matcher
+#      would need a per-row Python callback to recover first_hit_skill
 # ---------------------------------------------------------------------------
 
-con.execute("""
-    CREATE OR REPLACE VIEW resume_years_ai_first AS
+keywords = [k for (k,) in con.execute("SELECT skill FROM ai_keywords").fetchall()]
+AI_PATTERN = "|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+AI_PATTERN_SQL = AI_PATTERN.replace("'", "''")  # Escape quotes for the SQL literal
+
+con.execute(f"""
+    CREATE OR REPLACE TABLE resume_spells_ai AS
     SELECT
-        r.*,
-        (
-            SELECT k.skill
-            FROM ai_keywords k
-            WHERE POSITION(k.skill IN r.text_all) > 0
-            ORDER BY POSITION(k.skill IN r.text_all)  
-            LIMIT 1
-        ) AS first_hit_skill
-    FROM resume_years_text r
+        row_id,
+        (first_hit_skill IS NOT NULL)::UTINYINT AS ai_related,
+        first_hit_skill
+    FROM (
+        SELECT
+            row_id,
+            NULLIF(regexp_extract(text_all, '{AI_PATTERN_SQL}', 0), '') AS first_hit_skill
+        FROM resume_spells_text
+    )
 """)
 
-# ---------------------------------------------------------------------------
-# 6) Flag AI-related rows using the presence of first_hit_skill
-# ---------------------------------------------------------------------------
-
-con.execute("""
+con.execute(f"""
     CREATE OR REPLACE TABLE resume_years_ai AS
     SELECT
-        id,
-        title_name,
-        company_name_raw,
-        description_raw,
-        "year",
-        CASE WHEN first_hit_skill IS NOT NULL THEN 1 ELSE 0 END AS ai_related,
-        first_hit_skill
-    FROM resume_years_ai_first
-    ORDER BY id, title_name, "year";
+        y.id,
+        s.title_name,
+        s.company_name_raw,
+        y."year",
+        a.ai_related,
+        a.first_hit_skill
+    FROM {DEST_TABLE} y
+    JOIN resume_spells s USING (row_id)
+    JOIN resume_spells_ai a USING (row_id);
 """)
 
 # ---------------------------------------------------------------------------
-# 7) Aggregate to company-year: unique persons as denominator, AI persons as
+# 6) Aggregate to company-year: unique persons as denominator, AI persons as
 #    numerator, then compute ai_measure = ai_employees / employees
-#    - Use (company_name_raw, year, id) to avoid double-counting titles
+#    - COUNT(DISTINCT id) avoids double-counting titles: a person is counted
+#      once per company-year, and as an AI person if any of their rows hits
+#    - Both counts come from one aggregation over resume_years_ai, with no
+#      intermediate one-row-per-person table; the aggregation streams straight
+#      into the OUT_PARQUET_COMP file, so the company-year result is never
+#      materialized as a table
+#    - Group on the raw name only: a LOWER(TRIM(...)) key is a function of it,
+#      so adding one would not change the groups, only widen the hash table.
+#      Replace company_name_raw with LOWER(TRIM(company_name_raw)) below if
+#      you want names that differ only in case/spacing to be merged.
 # ---------------------------------------------------------------------------
 
 con.execute("""
-    CREATE OR REPLACE VIEW company_year_person AS
+  -- One row per company-year, far fewer rows than temp1: default-size row groups
+  COPY (
     SELECT
-        LOWER(TRIM(company_name_raw)) AS company_key,  -- Standardized key
-        company_name_raw              AS company_name, -- Display label 
+        company_name_raw AS company_name,                            -- Display label 
         "year",
-        id,
-        MAX(ai_related) AS ai_related_any  -- Any AI hit per person 
+        COUNT(DISTINCT id) AS employees,                             -- Unique persons 
+        COUNT(DISTINCT id) FILTER (WHERE ai_related = 1) AS ai_employees,   -- Persons with AI hit
+        CAST(ai_employees AS DOUBLE) / NULLIF(employees, 0) AS ai_measure  -- NULL only if no id is known
     FROM resume_years_ai
-    GROUP BY 1, 2, 3, 4
-""")
-
-con.execute("""
-    CREATE OR REPLACE TABLE company_year_ai AS
-    SELECT
-        company_name,
-        "year",
-        COUNT(*) AS employees,                 -- Unique persons 
-        SUM(ai_related_any) AS ai_employees,   -- Persons with AI hit
-        CASE WHEN COUNT(*) > 0
-             THEN CAST(SUM(ai_related_any) AS DOUBLE) / COUNT(*)
-             ELSE NULL
-        END AS ai_measure
-    FROM company_year_person
-    GROUP BY company_name, "year"
-    ORDER BY company_name, "year";
-""")
+    GROUP BY company_name_raw, "year"
+    ORDER BY company_name, "year"
+  )
+  TO ? (FORMAT PARQUET, COMPRESSION ZSTD, COMPRESSION_LEVEL 3, ROW_GROUP_SIZE 122880, PARQUET_VERSION V2);
+""", [OUT_PARQUET_COMP])
 
 # ---------------------------------------------------------------------------
-# 8) Persist outputs
+# 7) Persist the person-year flags
 # ---------------------------------------------------------------------------
 
-con.execute(f"""
-  COPY (SELECT * FROM resume_years_ai)
-  TO '{OUT_PARQUET_FLAG}' (FORMAT PARQUET);
-""")
-
-con.execute(f"""
-  COPY (SELECT * FROM company_year_ai)
-  TO '{OUT_PARQUET_COMP}' (FORMAT PARQUET);
-""")
\ No newline at end of file
+con.execute("""
+  -- One row per person-year: written unordered (sort when reading if needed)
+  COPY resume_years_ai
+  TO ? (FORMAT PARQUET, COMPRESSION ZSTD, COMPRESSION_LEVEL 3, ROW_GROUP_SIZE 1048576, PARQUET_VERSION V2);
+""", [OUT_PARQUET_FLAG])
\ No newline at end of file
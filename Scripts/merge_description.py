@@ -1,15 +1,32 @@
 """Merge profile and description parquet files using DuckDB
 
 This script reads all parquet files from the `profile` and `description`
-folders, performs a left join on `id` (keeping all profile records),
+folders, performs an inner join on `id` (only profiles with a description),
 filters out rows with missing `most_recent_company_start_month`,
 `company_name`, or `description_raw`, and writes the result to a single
-`merged.parquet` file, with a progress bar enabled.
+ZSTD-compressed `merged.parquet` file, with a progress bar enabled.
 """
 
+import os
 import duckdb
 
+try:
+    import psutil  # optional: used to count physical cores
+except ImportError:
+    psutil = None
+
+TMP_DIR = r"D:\\duckdb_tmp"   # DuckDB spill/temp directory for the join (fast disk)
+MEM_LIMIT = "24GB"            # memory cap; spills beyond this limit
+PROFILE_GLOB = "D:/profile/*.parquet"          # profile Parquet files
+DESCRIPTION_GLOB = "D:/description/*.parquet"  # description Parquet files
+OUT_PARQUET = "D:/merged.parquet"              # merged output
+N_THREADS = (psutil and psutil.cpu_count(logical=False)) or os.cpu_count()  # one thread per physical core
+
 con = duckdb.connect()
+con.execute(f"PRAGMA threads={N_THREADS};")
+con.execute("SET temp_directory = ?;", [TMP_DIR])
+con.execute(f"PRAGMA memory_limit='{MEM_LIMIT}';")
+con.execute("PRAGMA preserve_insertion_order=false;")
 con.execute("PRAGMA enable_progress_bar = true;")
 
 con.execute("""
@@ -22,11 +39,11 @@ COPY (
         p.most_recent_company_start_month,
         p.most_recent_company_end_month,
         d.description_raw
-    FROM read_parquet('D:/profile/*.parquet') AS p
-    LEFT JOIN read_parquet('D:/description/*.parquet') AS d
+    FROM read_parquet($profile_glob) AS p
+    JOIN read_parquet($description_glob) AS d
     USING (id)
     WHERE p.most_recent_company_start_month IS NOT NULL
       AND p.company_name IS NOT NULL
       AND d.description_raw IS NOT NULL
-) TO 'D:/merged.parquet' (FORMAT PARQUET);
-""")
\ No newline at end of file
+) TO $out_parquet (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 122880);
+""", {"profile_glob": PROFILE_GLOB, "description_glob": DESCRIPTION_GLOB, "out_parquet": OUT_PARQUET})
\ No newline at end of file
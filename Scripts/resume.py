@@ -1,5 +1,11 @@
 import duckdb 
 import os 
+import re 
+
+try:
+    import psutil  # optional: used to count physical cores
+except ImportError:
+    psutil = None
 
 INPUT_PATH = r"C:\\Users\\王亭烜\\Downloads\\us_profiles_samples_full.csv"
 TABLE_NAME = "resume" 
@@ -13,7 +19,17 @@ COL_COMPANY = "COMPANY_NAME_RAW"
 COL_DESC = "DESCRIPTION_RAW"
 COL_CURRENT = "IS_CURRENT"
 
+TMP_DIR = r"C:\\duckdb_temp"  # DuckDB spill/temp directory
+MEM_LIMIT = "20GB"
+N_THREADS = (psutil and psutil.cpu_count(logical=False)) or os.cpu_count()  # one thread per physical core
+
+os.makedirs(TMP_DIR, exist_ok=True)  # spill directory must exist before large joins/aggregations
+
 con = duckdb.connect() 
+con.execute(f"PRAGMA threads={N_THREADS};")
+con.execute("SET temp_directory = ?;", [TMP_DIR])
+con.execute(f"PRAGMA memory_limit='{MEM_LIMIT}';")
+con.execute("PRAGMA preserve_insertion_order=false;")  # Let COPY stream rows in any order; outputs that need order sort explicitly
 
 con.execute(f"""
     CREATE OR REPLACE TABLE {TABLE_NAME} AS
@@ -26,150 +42,159 @@ con.execute(f"""
             NULLIF(TRIM({COL_START}), '') AS start_txt,
             NULLIF(TRIM({COL_END}),   '') AS end_txt,
             NULLIF(TRIM({COL_CURRENT}), '') AS is_current_txt
-        FROM read_csv_auto('{INPUT_PATH}',
+        FROM read_csv_auto(?,
                            header=true,
                            sample_size=-1,
                            all_varchar=true)
     )
     SELECT
         id, title_name, company_name_raw, description_raw,
-        CAST(try_strptime(start_txt || '-01', '%Y-%m-%d') AS DATE) AS job_start_ym,
-        CAST(try_strptime(end_txt   || '-01', '%Y-%m-%d') AS DATE) AS job_end_ym,
+        TRY_CAST(substr(start_txt, 1, 4) AS SMALLINT) AS job_start_year,  -- 'YYYY-MM': only the year is used
+        TRY_CAST(substr(end_txt,   1, 4) AS SMALLINT) AS job_end_year,
         COALESCE(TRY_CAST(is_current_txt AS INTEGER), 0) AS is_current
     FROM raw
-""")
+""", [INPUT_PATH])
 
+# Keep the text columns on the spell table (one row per spell); the yearly
+# table only carries (row_id, id, year) and joins back on row_id
 con.execute(f"""
-    CREATE OR REPLACE TABLE {DEST_TABLE} AS
+    CREATE OR REPLACE TABLE resume_spells AS
     WITH base AS (
         SELECT
-            id, title_name, company_name_raw, description_raw, job_start_ym, job_end_ym, is_current,
-            year(job_start_ym) AS sy,
+            id, title_name, company_name_raw, description_raw, is_current,
+            job_start_year AS sy,
             CASE
-              WHEN job_end_ym IS NOT NULL THEN year(job_end_ym)
+              WHEN job_end_year IS NOT NULL THEN job_end_year
               WHEN is_current = 1           THEN year(current_date())
               ELSE NULL
             END AS ey_pre
         FROM {TABLE_NAME}
-        WHERE job_start_ym IS NOT NULL
+        WHERE job_start_year IS NOT NULL
     ),
     filtered AS (
         -- Drop observations where end is missing and is_current=0 (ey_pre is NULL)
-        SELECT
+        -- DISTINCT drops exact duplicate spells before they are expanded to years
+        SELECT DISTINCT
             id, title_name, company_name_raw, description_raw, sy,
             GREATEST(ey_pre, sy) AS ey  -- Prevent end < start; rows with NULL ey_pre won't enter here 
         FROM base
         WHERE ey_pre IS NOT NULL
     )
     SELECT
+        row_number() OVER () AS row_id,  -- Spell key used to join yearly rows back
         id,
         title_name,
         company_name_raw,
         description_raw,
-        y AS year
+        sy,
+        ey
     FROM filtered
-    CROSS JOIN range(sy, ey + 1) AS t(y)   -- Inclusive of the ending year 
-    ORDER BY id, year
 """)
 
-OUT_PARQUET = r"C:\\Users\\王亭烜\\Desktop\\RA\\Konan\\temp.parquet"
 con.execute(f"""
-  COPY (SELECT * FROM resume_years ORDER BY id, title_name, year)
-  TO '{OUT_PARQUET}'
-  (FORMAT PARQUET);
+    CREATE OR REPLACE TABLE {DEST_TABLE} AS
+    SELECT
+        row_id,
+        id,
+        unnest(generate_series(sy, ey)) AS year  -- Inclusive of the ending year 
+    FROM resume_spells
 """)
 
+OUT_PARQUET = r"C:\\Users\\王亭烜\\Desktop\\RA\\Konan\\temp.parquet"
+con.execute(f"""
+  COPY (
+    SELECT y.id, s.title_name, s.company_name_raw, y.year
+    FROM {DEST_TABLE} y
+    JOIN resume_spells s USING (row_id)
+  )
+  TO ?
+  (FORMAT PARQUET, COMPRESSION ZSTD, COMPRESSION_LEVEL 3, ROW_GROUP_SIZE 1048576, PARQUET_VERSION V2);
+""", [OUT_PARQUET])
+
 #=======================================================================
 
 KEYWORDS_PARQUET = r"E:\\out\\top100_ai_skills_all_years.parquet"
 
-con.execute(f"""
-    CREATE TABLE ai_keywords AS
+con.execute("""
+    CREATE TEMP TABLE ai_keywords AS
     SELECT DISTINCT LOWER(TRIM(skill)) AS skill
-    FROM read_parquet('{KEYWORDS_PARQUET}')
+    FROM read_parquet(?)
     WHERE skill IS NOT NULL AND TRIM(skill) <> '';
-""")
+""", [KEYWORDS_PARQUET])
 
+# Build text_all once per spell so lower()/concat do not repeat for every year
 con.execute("""
-    CREATE VIEW resume_years_text AS
+    CREATE OR REPLACE TABLE resume_spells_text AS
     SELECT
-        id,
-        title_name,
-        company_name_raw,
-        description_raw,
-        "year",
+        row_id,
         LOWER(COALESCE(title_name, '')) || ' ' || LOWER(COALESCE(description_raw, '')) AS text_all
-    FROM resume_years
+    FROM resume_spells
 """)
 
-con.execute("""
-    CREATE OR REPLACE VIEW resume_years_ai_first AS
+# Compile all keywords into one regex alternation (longest first, so the longest
+# keyword wins on ties) and scan each text_all once instead of once per keyword
+keywords = [k for (k,) in con.execute("SELECT skill FROM ai_keywords").fetchall()]
+AI_PATTERN = "|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+AI_PATTERN_SQL = AI_PATTERN.replace("'", "''")
+
+con.execute(f"""
+    CREATE OR REPLACE TABLE resume_spells_ai AS
     SELECT
-        r.*,
-        (
-            SELECT k.skill
-            FROM ai_keywords k
-            WHERE POSITION(k.skill IN r.text_all) > 0
-            ORDER BY POSITION(k.skill IN r.text_all)  -- The earliest (left-most) match 
-            LIMIT 1
-        ) AS first_hit_skill
-    FROM resume_years_text r
+        row_id,
+        (first_hit_skill IS NOT NULL)::UTINYINT AS ai_related,
+        first_hit_skill
+    FROM (
+        -- Find the hit and flag it in the same pass over resume_spells_text
+        SELECT
+            row_id,
+            NULLIF(regexp_extract(text_all, '{AI_PATTERN_SQL}', 0), '') AS first_hit_skill  -- The earliest (left-most) match 
+        FROM resume_spells_text
+    )
 """)
 
-con.execute("""
+# Attach the spell-level flag to every year of the spell
+con.execute(f"""
     CREATE OR REPLACE TABLE resume_years_ai AS
     SELECT
-        id,
-        title_name,
-        company_name_raw,
-        description_raw,
-        "year",
-        CASE WHEN first_hit_skill IS NOT NULL THEN 1 ELSE 0 END AS ai_related,
-        first_hit_skill
-    FROM resume_years_ai_first
-    ORDER BY id, title_name, "year";
+        y.id,
+        s.title_name,
+        s.company_name_raw,
+        y."year",
+        a.ai_related,
+        a.first_hit_skill
+    FROM {DEST_TABLE} y
+    JOIN resume_spells s USING (row_id)
+    JOIN resume_spells_ai a USING (row_id);
 """)
 
 #=============================================================================
 
+OUT_PARQUET_FLAG = r"C:\\Users\\王亭烜\\Desktop\\RA\\Konan\\temp1.parquet"
 con.execute("""
-    -- First collapse to one row per year (company, year, person) to avoid double-counting
-    -- when the same person has multiple roles/titles in the same company-year 
-    CREATE OR REPLACE VIEW company_year_person AS
-    SELECT
-        LOWER(TRIM(company_name_raw)) AS company_key,  -- Can be used as a standardized key
-        company_name_raw              AS company_name, -- Keep the raw name for display 
-        "year",
-        id,
-        MAX(ai_related) AS ai_related_any  -- Whether this person has any AI hit in that year (at least once)
-    FROM resume_years_ai
-    GROUP BY 1, 2, 3, 4
-""");
+  -- One row per person-year: written unordered (sort when reading if needed)
+  COPY resume_years_ai
+  TO ? (FORMAT PARQUET, COMPRESSION ZSTD, COMPRESSION_LEVEL 3, ROW_GROUP_SIZE 1048576, PARQUET_VERSION V2);
+""", [OUT_PARQUET_FLAG])
 
+OUT_PARQUET_COMP = r"C:\\Users\\王亭烜\\Desktop\\RA\\Konan\\temp2.parquet"
 con.execute("""
-    CREATE OR REPLACE TABLE company_year_ai AS
+  -- Count distinct persons per (company, year) to avoid double-counting
+  -- when the same person has multiple roles/titles in the same company-year;
+  -- a person is an AI employee if any of their rows has an AI hit.
+  -- Grouped on the raw name only; use LOWER(TRIM(company_name_raw)) instead to
+  -- merge names that differ only in case/spacing.
+  -- The aggregation streams straight into the Parquet writer, no intermediate table;
+  -- one row per company-year, far fewer rows than temp1: default-size row groups
+  COPY (
     SELECT
-        company_name,
+        company_name_raw AS company_name,  -- Keep the raw name for display 
         "year",
-        COUNT(*) AS employees,  -- Already one row per person 
-        SUM(ai_related_any) AS ai_employees,
-        CASE WHEN COUNT(*) > 0
-             THEN CAST(SUM(ai_related_any) AS DOUBLE) / COUNT(*)
-             ELSE NULL
-        END AS ai_measure
-    FROM company_year_person
-    GROUP BY company_name, "year"
-    ORDER BY company_name, "year";
-""")
-
-OUT_PARQUET_FLAG = r"C:\\Users\\王亭烜\\Desktop\\RA\\Konan\\temp1.parquet"
-con.execute(f"""
-  COPY (SELECT * FROM resume_years_ai)
-  TO '{OUT_PARQUET_FLAG}' (FORMAT PARQUET);
-""")
-
-OUT_PARQUET_COMP = r"C:\\Users\\王亭烜\\Desktop\\RA\\Konan\\temp2.parquet"
-con.execute(f"""
-  COPY (SELECT * FROM company_year_ai)
-  TO '{OUT_PARQUET_COMP}' (FORMAT PARQUET);
-""")
\ No newline at end of file
+        COUNT(DISTINCT id) AS employees,
+        COUNT(DISTINCT id) FILTER (WHERE ai_related = 1) AS ai_employees,
+        CAST(ai_employees AS DOUBLE) / NULLIF(employees, 0) AS ai_measure  -- NULL only if no id is known
+    FROM resume_years_ai
+    GROUP BY company_name_raw, "year"
+    ORDER BY company_name, "year"
+  )
+  TO ? (FORMAT PARQUET, COMPRESSION ZSTD, COMPRESSION_LEVEL 3, ROW_GROUP_SIZE 122880, PARQUET_VERSION V2);
+""", [OUT_PARQUET_COMP])
\ No newline at end of file